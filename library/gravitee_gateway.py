@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from multiprocessing.pool import ThreadPool
+
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import fetch_url
 
@@ -84,6 +86,12 @@ options:
             - List of plans associated with the API
             - Body payload in Json for Plan update or creation
         required: false                                                   
+    return_responses:
+        description:
+            - Return request and response bodies in 'responses', for debugging purpose
+            - Only url, http status and method are returned otherwise
+        required: false
+        default: false
 
 author:
     - fabrice.mercier
@@ -196,7 +204,7 @@ EXAMPLES = '''
 
 RETURN = '''
 output:
-  description: the data returned, responses contains a list of all http responses body
+  description: the data returned, responses contains a list of all http responses, with bodies when return_responses is set
   returned: success
   type: dict
   sample:
@@ -210,6 +218,32 @@ output:
 '''
 
 
+MAX_CONCURRENT_REQUESTS = 16
+
+
+class RequestFailure(Exception):
+
+    """
+        Raised by a request issued from a dispatched wrapper, the failure is reported once all wrappers are done
+    """
+
+
+class DispatchedModule(object):
+
+    """
+        AnsibleModule proxy given to dispatched wrappers, fail_json raises RequestFailure instead of exiting
+    """
+
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def fail_json(self, msg=None, **kwargs):
+        raise RequestFailure(msg)
+
+
 class ApiGatewayWrapper(object):
 
     """
@@ -219,9 +253,14 @@ class ApiGatewayWrapper(object):
     def __init__(self, module):
         self.module = module
         self.api_path = '/management'
+        self.responses = None
+        self.headers = {
+            "Content-Type": 'application/json'
+        }
+        self._configure_auth_strategy(self.headers)
 
     def _configure_auth_strategy(self, headers):
-        if self.module.params['token'] is not None:
+        if self.module.params.get('token') is not None:
             headers['Authorization'] = 'Bearer {}'.format(self.module.params['token'])
         else:
             self.module.params['force_basic_auth'] = True
@@ -247,17 +286,13 @@ class ApiGatewayWrapper(object):
             .. raises:: SystemExit(1)
             .. seealso:: ansible.module_utils.urls.fetch_url(), run_module()
             .. warning:: timeout is set up to 10s
+            .. note:: fetch_url does not keep connections alive, concurrency is handled by dispatch()
         """
         assert self.module.params.get('url')
         url = self.module.params['url'] + endpoint
 
-        headers = {
-            "Content-Type": 'application/json'
-        }
-
-        self._configure_auth_strategy(headers)
-
-        response, info = fetch_url(self.module, url, headers=headers, data=self.module.jsonify(data), timeout=10, method=method)
+        payload = self.module.jsonify(data) if data is not None else None
+        response, info = fetch_url(self.module, url, headers=self.headers, data=payload, timeout=10, method=method)
 
         result = dict(
             url=url,
@@ -271,7 +306,7 @@ class ApiGatewayWrapper(object):
             self.module.fail_json(msg=str(info['body']))
 
         body = None
-        if response:
+        if response and info['status'] != 204:
             body = response.read().decode('utf-8')
 
         if body:
@@ -280,9 +315,66 @@ class ApiGatewayWrapper(object):
             except ValueError as e:
                 result['response_body'] = body
 
-        self.module.result['responses'].append(result)
+        if self.module.params.get('return_responses'):
+            entry = result
+        else:
+            entry = dict(url=url, http_status=info['status'], http_method=method)
+
+        if self.responses is None:
+            self.module.result['responses'].append(entry)
+        else:
+            self.responses.append(entry)
         return result
 
+    def dispatch(self, wrappers, action):
+        """
+            Run the same action on independent wrappers concurrently
+
+            Each wrapper action is run in a thread pool so that HTTP round-trips overlap.
+            Responses are collected per wrapper and appended to the module result in wrappers order.
+            All actions are attempted, failures are then reported together.
+            Wrappers run against a DispatchedModule so that no worker thread emits the module result.
+
+            :param wrappers: list of ApiGatewayWrapper
+            :param action: name of the wrapper method to call, without argument
+            :type wrappers: list
+            :type action: string
+
+            .. raises:: SystemExit(1)
+        """
+        if not wrappers:
+            return
+
+        def run(wrapper):
+            module, wrapper.module = wrapper.module, DispatchedModule(wrapper.module)
+            wrapper.responses = []
+            try:
+                getattr(wrapper, action)()
+            except RequestFailure as e:
+                return str(e)
+            except SystemExit as e:
+                return e
+            finally:
+                wrapper.module = module
+
+        pool = ThreadPool(min(len(wrappers), MAX_CONCURRENT_REQUESTS))
+        try:
+            errors = pool.map(run, wrappers)
+        finally:
+            pool.close()
+            pool.join()
+
+        for wrapper in wrappers:
+            self.module.result['responses'].extend(wrapper.responses)
+            wrapper.responses = None
+
+        for error in errors:
+            if isinstance(error, SystemExit):
+                raise error
+        errors = [error for error in errors if error]
+        if errors:
+            self.module.fail_json(msg='\n'.join(errors))
+
 
 class AuthenticationWrapper(ApiGatewayWrapper):
 
@@ -312,6 +404,7 @@ class PlanWrapper(ApiGatewayWrapper):
         ApiGatewayWrapper.__init__(self, module)
         self.api_id = api_id
         self.plan = plan
+        self.plans_endpoint = '{}/apis/{}/plans'.format(self.api_path, api_id)
 
     def create_or_update(self):
         if self.plan.get('id'):
@@ -320,16 +413,16 @@ class PlanWrapper(ApiGatewayWrapper):
             self.create()
 
     def create(self):
-        result = self.request('{}/apis/{}/plans'.format(self.api_path, self.api_id), 'POST', dict(self.plan))['response_body']
+        result = self.request(self.plans_endpoint, 'POST', dict(self.plan))['response_body']
         self.plan['id'] = result['id']
 
     def update(self):
         assert self.plan['id']
-        self.request('{}/apis/{}/plans/{}'.format(self.api_path, self.api_id, self.plan['id']), 'PUT', self.plan)
+        self.request(self.plans_endpoint + '/' + self.plan['id'], 'PUT', self.plan)
 
     def remove(self):
         assert self.plan['id']
-        self.request('{}/apis/{}/plans/{}'.format(self.api_path, self.api_id, self.plan['id']), 'DELETE')
+        self.request(self.plans_endpoint + '/' + self.plan['id'], 'DELETE')
 
 
 class UserWrapper(ApiGatewayWrapper):
@@ -344,24 +437,42 @@ class UserWrapper(ApiGatewayWrapper):
 
 class ConfigurationWrapper(ApiGatewayWrapper):
 
-
     """
-       Search groups with filtering
+        REST API Configuration Wrapper
+    """
 
-       Search groups with filtering. Name filtering expect a list of dict.
-       Each dict have to contains a 'name' key. The filtering is applied with 'in' operator.
+    def __init__(self, module):
+        ApiGatewayWrapper.__init__(self, module)
+        self.groups = None
+        self.groups_by_name = None
+
+    def fetch_groups(self):
+        if self.groups is None:
+            self.groups = self.request('{}/configuration/groups'.format(self.api_path), 'GET')['response_body']
+        return self.groups
 
-       :param name_filter: list of dict, default is None
-       :type name_filter: list
-       :returns: list of group matched
-       :rtype: list
-    """
     def search_groups(self, name_filter=None):
-        groups = self.request('{}/configuration/groups'.format(self.api_path), 'GET')['response_body']
+        """
+            Search groups with filtering
+
+            Search groups with filtering. Name filtering expects a list of group names.
+            A group matches when one of the names is contained in its 'name' ('in' operator).
+
+            :param name_filter: list of group names, default is None
+            :type name_filter: list
+            :returns: list of group matched
+            :rtype: list
+        """
+        groups = self.fetch_groups()
         if name_filter:
             groups = [group for group in groups if any(name in group['name'] for name in name_filter)]
         return groups
 
+    def get_groups_by_name(self):
+        if self.groups_by_name is None:
+            self.groups_by_name = {group['name']: group['id'] for group in self.fetch_groups()}
+        return self.groups_by_name
+
 
 class PageWrapper(ApiGatewayWrapper):
 
@@ -369,12 +480,13 @@ class PageWrapper(ApiGatewayWrapper):
         REST API Page Wrapper
     """
 
-    def __init__(self, module, api_id, page):
+    def __init__(self, module, api_id, page, config_wrapper=None):
         ApiGatewayWrapper.__init__(self, module)
         assert page['order']
         self.page = page
         self.api_id = api_id
-        self.config_wrapper = ConfigurationWrapper(self.module)
+        self.pages_endpoint = '{}/apis/{}/pages'.format(self.api_path, api_id)
+        self.config_wrapper = config_wrapper or ConfigurationWrapper(self.module)
         if self.page.get('excluded_groups'):
             self.page['excluded_groups'] = self.filter_excluded_groups()
 
@@ -385,23 +497,21 @@ class PageWrapper(ApiGatewayWrapper):
             self.create()
 
     def create(self):
-        result = self.request('{}/apis/{}/pages'.format(self.api_path, self.api_id), 'POST', dict(self.page))['response_body']
+        result = self.request(self.pages_endpoint, 'POST', dict(self.page))['response_body']
         self.page['id'] = result['id']
 
     def update(self):
         assert self.page['id']
-        page = dict(self.page)
-        for x in ['id', 'type']:
-            del page[x]
-        self.request('{}/apis/{}/pages/{}'.format(self.api_path, self.api_id, self.page['id']), 'PUT', page)
+        page = {k: v for k, v in self.page.items() if k not in ('id', 'type')}
+        self.request(self.pages_endpoint + '/' + self.page['id'], 'PUT', page)
 
     def remove(self):
         assert self.page['id']
-        self.request('{}/apis/{}/pages/{}'.format(self.api_path, self.api_id, self.page['id']), 'DELETE')
+        self.request(self.pages_endpoint + '/' + self.page['id'], 'DELETE')
 
     def filter_excluded_groups(self):
-        groups = self.config_wrapper.search_groups(self.page['excluded_groups'])
-        return [group['id'] for group in groups]
+        groups = self.config_wrapper.get_groups_by_name()
+        return [groups[name] for name in self.page['excluded_groups'] if name in groups]
 
 
 class ApiWrapper(ApiGatewayWrapper):
@@ -409,20 +519,25 @@ class ApiWrapper(ApiGatewayWrapper):
     def __init__(self, module):
         ApiGatewayWrapper.__init__(self, module)
         self.api_entity = self.module.params.get('config')
-        self.api_id = self.module.params.get('api_id')
+        self.apis_endpoint = '{}/apis'.format(self.api_path)
+        self.set_api_id(self.module.params.get('api_id'))
         self.visibility = self.module.params.get('visibility')
         self.transfer_ownership = self.module.params.get('transfer_ownership')
         self.state = self.module.params.get('state')
         self.plans = self.module.params.get('plans')
         self.pages = self.module.params.get('pages')
+        self.config_wrapper = ConfigurationWrapper(self.module)
+        self.deploy_required = False
+        self.current_api = None
 
     def create(self):
         assert self.api_entity
 
         self.verify()
 
-        result = self.request('{}/apis'.format(self.api_path), 'POST', self.api_entity)
-        self.api_id = result['response_body']['id']
+        result = self.request(self.apis_endpoint, 'POST', self.api_entity)
+        self.set_api_id(result['response_body']['id'])
+        self.current_api = result['response_body']
 
         self.module.result['changed'] = True
         self.module.result['api_id'] = self.api_id
@@ -431,7 +546,7 @@ class ApiWrapper(ApiGatewayWrapper):
             self.transfer_owner()
 
         if self.visibility != 'PRIVATE':
-            update_data = result['response_body']
+            update_data = dict(result['response_body'])
             update_data['visibility'] = self.visibility
             for x in ['created_at', 'updated_at', 'state', 'owner', 'id', 'workflow_state']:
                 update_data.pop(x, None)
@@ -444,8 +559,10 @@ class ApiWrapper(ApiGatewayWrapper):
         if self.pages:
             self.create_or_update_api_pages()
 
-        if self.state == 'started':
+        if self.deploy_required or self.state == 'started':
             self.deploy()
+
+        if self.state == 'started':
             self.start()
 
     def update(self):
@@ -459,35 +576,50 @@ class ApiWrapper(ApiGatewayWrapper):
             self.create_or_update_api_pages()
         if self.transfer_ownership['user']:
             self.transfer_owner()
+        if self.deploy_required:
+            self.deploy()
         if self.state == 'started':
             self.start()
         elif self.state == 'stopped':
             self.stop()
 
+    def set_api_id(self, api_id):
+        self.api_id = api_id
+        self.api_endpoint = '{}/{}'.format(self.apis_endpoint, api_id)
+
     def get_api(self):
         assert self.api_id
-        return self.request('{}/apis/{}'.format(self.api_path, self.api_id), 'GET')['response_body']
+        self.current_api = self.request(self.api_endpoint, 'GET')['response_body']
+        return self.current_api
+
+    def get_current_api(self):
+        if self.current_api is None:
+            self.get_api()
+        return self.current_api
 
     def update_api_entity(self):
         assert self.api_id
-        self.request('{}/apis/{}'.format(self.api_path, self.api_id), 'PUT', self.api_entity)
-        self.deploy()
+        current_api = self.get_current_api()
+        if all(current_api.get(key) == value for key, value in self.api_entity.items()):
+            return
+        self.current_api = self.request(self.api_endpoint, 'PUT', self.api_entity)['response_body']
+        self.deploy_required = True
         self.module.result['changed'] = True
 
     def create_or_update_api_plans(self):
         assert self.api_id
         plans = [PlanWrapper(self.module, self.api_id, plan) for plan in self.plans]
-        for plan in plans:
-            plan.create_or_update()
-        self.deploy()
+        self.dispatch(plans, 'create_or_update')
+        self.deploy_required = True
 
     def verify(self):
         data = {'context_path': self.api_entity['contextPath']}
-        self.request('{}/apis/verify'.format(self.api_path), 'POST', data)
+        self.request(self.apis_endpoint + '/verify', 'POST', data)
 
     def deploy(self):
         assert self.api_id
-        self.request('{}/apis/{}/deploy'.format(self.api_path, self.api_id), 'POST')
+        self.request(self.api_endpoint + '/deploy', 'POST')
+        self.deploy_required = False
         self.module.result['changed'] = True
 
     def transfer_owner(self):
@@ -500,34 +632,36 @@ class ApiWrapper(ApiGatewayWrapper):
         data = {'role': self.transfer_ownership['owner_role'], 'reference': result[0]['reference']}
         if "id" in result[0]:
             data['id'] = result[0]['id']
-        self.request('{}/apis/{}/members/transfer_ownership'.format(self.api_path, self.api_id), 'POST', data)
+        self.request(self.api_endpoint + '/members/transfer_ownership', 'POST', data)
         self.module.result['changed'] = True
 
     def start(self):
         assert self.api_id
-        api_entity = self.get_api()
+        api_entity = self.get_current_api()
         if api_entity['state'].upper() != 'STARTED':
-            self.request('{}/apis/{}?action=START'.format(self.api_path, self.api_id), 'POST')
+            self.request(self.api_endpoint + '?action=START', 'POST')
+            self.current_api = None
             self.module.result['changed'] = True
         self.module.result['state'] = 'STARTED'
 
     def stop(self):
         assert self.api_id
-        api_entity = self.get_api()
+        api_entity = self.get_current_api()
         if api_entity['state'].upper() != 'STOPPED':
-            self.request('{}/apis/{}?action=STOP'.format(self.api_path, self.api_id), 'POST')
+            self.request(self.api_endpoint + '?action=STOP', 'POST')
+            self.current_api = None
             self.module.result['changed'] = True
         self.module.result['state'] = 'STOPPED'
 
     def get_plans(self):
-        return self.request('{}/apis/{}/plans'.format(self.api_path, self.api_id), 'GET')['response_body']
+        return self.request(self.api_endpoint + '/plans', 'GET')['response_body']
 
     def remove(self):
         assert self.api_id
-        for plan in [PlanWrapper(self.module, self.api_id, plan) for plan in self.get_plans()]:
-            plan.remove()
+        plans = [PlanWrapper(self.module, self.api_id, plan) for plan in self.get_plans()]
+        self.dispatch(plans, 'remove')
         self.stop()
-        self.request('{}/apis/{}'.format(self.api_path, self.api_id), 'DELETE')
+        self.request(self.api_endpoint, 'DELETE')
         self.module.result['state'] = 'absent'
         self.module.result['changed'] = True
 
@@ -535,9 +669,8 @@ class ApiWrapper(ApiGatewayWrapper):
         assert self.api_id
         for index, page in enumerate(self.pages, start=1):
             page['order'] = index
-        page_wrappers = [PageWrapper(self.module, self.api_id, page) for page in self.pages]
-        for page_wrapper in page_wrappers:
-            page_wrapper.create_or_update()
+        page_wrappers = [PageWrapper(self.module, self.api_id, page, self.config_wrapper) for page in self.pages]
+        self.dispatch(page_wrappers, 'create_or_update')
 
 
 def run_module():
@@ -560,7 +693,8 @@ def run_module():
         api_id=dict(required=False, default=None),
         transfer_ownership=dict(type='dict', required=False, default=None, elements='dict', options=ownership_spec),
         url=dict(required=True),
-        validate_certs=dict(type='bool', default=False)
+        validate_certs=dict(type='bool', default=False),
+        return_responses=dict(type='bool', default=False)
     )
 
     module = AnsibleModule(
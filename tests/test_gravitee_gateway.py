@@ -1,385 +1,431 @@
 #!/usr/bin/python
 
+import itertools
+
 import pytest
-import mock
 from library import gravitee_gateway
 
-TRANSFER_OWNER = {
+try:
+    from unittest.mock import Mock, call, patch
+except ImportError:
+    from mock import Mock, call, patch
+
+ApiGatewayWrapper = gravitee_gateway.ApiGatewayWrapper
+ApiWrapper = gravitee_gateway.ApiWrapper
+PlanWrapper = gravitee_gateway.PlanWrapper
+PageWrapper = gravitee_gateway.PageWrapper
+UserWrapper = gravitee_gateway.UserWrapper
+ConfigurationWrapper = gravitee_gateway.ConfigurationWrapper
+RequestFailure = gravitee_gateway.RequestFailure
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    MappingProxyType = dict
+
+TRANSFER_OWNER = MappingProxyType({
     "user": "foo@mycompany.com",
     "owner_role": "OWNER"
-}
+})
 
-CREATE_API = {
+CREATE_API = MappingProxyType({
     "contextPath": "/test/api"
-}
+})
 
-CREATE_RESPONSE = {
+CREATE_RESPONSE = MappingProxyType({
     "created_at": "",
     "updated_at": "",
     "state": "INITIALIZED",
     "owner": "toto",
     "id": "1234"
-}
-
-PAGE = {
+})
+
+CREATE_STARTED_SIDE_EFFECTS = (None, {'response_body': CREATE_RESPONSE}, {'response_body': CREATE_RESPONSE}, None, None)
+
+REMOVE_SIDE_EFFECTS = ({'response_body': ({'id': '456'}, {'id': '786'})}, {'response_body': {'state': 'started'}}, None, None)
+
+USER_ADMIN = MappingProxyType({
+    "reference": 'ZXlKamRIa2lPaUpLVjFRaUxDSmxibU',
+    "firstname": 'admin',
+    "lastname": 'admin',
+    "displayName": 'admin'
+})
+
+USER_ADMIN_WITH_ID = MappingProxyType(dict(USER_ADMIN, id='09c92aaa-998d-5db5-e79b-add2a7e5ad4'))
+
+OK_RESPONSES = {status: {'status': status} for status in (200, 201, 204)}
+
+ERROR_RESPONSES = {status: ({}, {'status': status, 'body': 'error'}) for status in (300, 400, 500)}
+
+MYGROUP_ID = "87b2858d-5466-4a4a-b285-8d54667a4a8a"
+EXTERNAL_ID = "c2de10db-ds-49bc-9e10-dbdbad79bcd0"
+
+CONFIGURATION_GROUPS = (
+    MappingProxyType({
+        "id": MYGROUP_ID,
+        "name": "mygroup",
+        "created_at": 1521457603916,
+        "updated_at": 1521457603916
+    }),
+    MappingProxyType({
+        "id": "c2de10db-dbad-49bc-9e10-dbdbad79bcd1",
+        "name": "others",
+        "created_at": 1521458754100,
+        "updated_at": 1521458754100
+    }),
+    MappingProxyType({
+        "id": EXTERNAL_ID,
+        "name": "external",
+        "created_at": 1521458754100,
+        "updated_at": 1521458754100
+    })
+)
+
+PAGE = MappingProxyType({
     "type": "SWAGGER",
-    "excluded_groups": ["mygroup"]
-}
+    "excluded_groups": ("mygroup",)
+})
 
 API_PATH = '/management'
+API_ID = '1234'
+APIS = API_PATH + '/apis'
+API_1234 = APIS + '/' + API_ID
+PLANS_1234 = API_1234 + '/plans'
+PAGES_1234 = API_1234 + '/pages'
+GROUPS = API_PATH + '/configuration/groups'
+
+BASE_PARAMS = {
+    "url": "https://manage-api.mycompany.com",
+    "user": "admin",
+    "password": "admin",
+    "visibility": "PRIVATE"
+}
 
 
 @pytest.fixture()
 def module(mocker):
     module_mock = mocker.MagicMock()
-    module_mock.params = {
-        "url": "https://manage-api.mycompany.com",
-        "user": "admin",
-        "password": "admin",
-        "visibility": "PRIVATE"
-    }
+    module_mock.params = dict(BASE_PARAMS)
     return module_mock
 
 
-class TestGraviteeGateway(object):
+@pytest.fixture()
+def fetch_url_mock(monkeypatch):
+    fetch_url = Mock()
+    monkeypatch.setattr(gravitee_gateway, 'fetch_url', fetch_url)
+    return fetch_url
+
+
+@pytest.fixture()
+def plan_request_mock(monkeypatch):
+    request = Mock()
+    monkeypatch.setattr(PlanWrapper, 'request', request)
+    return request
+
+
+@pytest.fixture()
+def user_search_mock(monkeypatch):
+    search = Mock()
+    monkeypatch.setattr(UserWrapper, 'search', search)
+    return search
+
+
+@pytest.fixture(scope="session")
+def user_payload():
+    return {"one": [USER_ADMIN], "many": [USER_ADMIN_WITH_ID, USER_ADMIN]}
+
+
+@pytest.fixture()
+def api_wrapper(mocker, module):
+    def make(**params):
+        module.params.update(params)
+        wrapper = ApiWrapper(module)
+        wrapper.request = mocker.Mock()
+        return wrapper
+    return make
+
+
+@pytest.fixture()
+def plan_wrapper(mocker, module):
+    def make(plan):
+        wrapper = PlanWrapper(module, API_ID, plan)
+        wrapper.request = mocker.Mock()
+        return wrapper
+    return make
+
+
+@pytest.fixture()
+def user_wrapper(mocker, module):
+    wrapper = UserWrapper(module)
+    wrapper.request = mocker.Mock()
+    return wrapper
+
+
+@pytest.fixture()
+def config_wrapper(mocker, module):
+    wrapper = ConfigurationWrapper(module)
+    wrapper.request = mocker.Mock()
+    wrapper.request.return_value = {'response_body': list(CONFIGURATION_GROUPS)}
+    return wrapper
 
-    @mock.patch('library.gravitee_gateway.fetch_url')
-    def test_request_failure_if_no_url(self, _fetch_url, module):
-        del module.params['url']
-        wrapper = gravitee_gateway.ApiGatewayWrapper(module)
-        with pytest.raises(AssertionError):
-            wrapper.request('{}/apis', 'GET')
 
-    @pytest.mark.parametrize("test_input", [
-        pytest.param(500, marks=pytest.mark.xfail),
-        pytest.param(300, marks=pytest.mark.xfail),
-        pytest.param(400, marks=pytest.mark.xfail)
+@pytest.fixture()
+def page_wrapper(mocker, module, config_wrapper):
+    def make(page):
+        wrapper = PageWrapper(module, API_ID, page, config_wrapper)
+        wrapper.request = mocker.Mock()
+        return wrapper
+    return make
+
+
+class TestGraviteeGateway(object):
+
+    @pytest.mark.parametrize("status,expect_fail", [
+        (200, False), (201, False), (204, False),
+        (300, True), (400, True), (500, True),
+        (None, "assert")
     ])
-    @mock.patch('library.gravitee_gateway.fetch_url')
-    def test_request_failure(self, fetch_url, _mocker, module, test_input):
-        wrapper = gravitee_gateway.ApiGatewayWrapper(module)
+    def test_request(self, fetch_url_mock, mocker, module, status, expect_fail):
+        if expect_fail == "assert":
+            del module.params['url']
         module.fail_json.side_effect = SystemExit(1)
-        fetch_url.return_value = ({}, {'status': test_input, 'body': 'error'})
-        wrapper.request('{}/apis'.format(API_PATH), 'GET')
-
-    @pytest.mark.parametrize("test_input", [
-        200, 201, 204,
+        wrapper = ApiGatewayWrapper(module)
+        if expect_fail == "assert":
+            with pytest.raises(AssertionError):
+                wrapper.request(APIS, 'GET')
+            fetch_url_mock.assert_not_called()
+        elif expect_fail:
+            fetch_url_mock.return_value = ERROR_RESPONSES[status]
+            with pytest.raises(SystemExit):
+                wrapper.request(APIS, 'GET')
+        else:
+            response = mocker.Mock()
+            response.read.return_value.decode.return_value = "['foo', {'bar':['baz', null, 1.0, 2]}]"
+            fetch_url_mock.return_value = (response, OK_RESPONSES[status])
+            wrapper.request(APIS, 'GET')
+            module.fail_json.assert_not_called()
+            module.jsonify.assert_not_called()
+            assert response.read.called == (status != 204)
+
+    @pytest.mark.parametrize("return_responses,expected_response", [
+        (False, {'url': BASE_PARAMS['url'] + APIS, 'http_status': 200, 'http_method': 'POST'}),
+        (True, {'url': BASE_PARAMS['url'] + APIS, 'http_status': 200, 'http_method': 'POST',
+                'request_body': CREATE_API, 'response_body': None})
     ])
-    @mock.patch('library.gravitee_gateway.fetch_url')
-    def test_request_ok(self, fetch_url, mocker, module, test_input):
-        wrapper = gravitee_gateway.ApiGatewayWrapper(module)
-        response = mocker.MagicMock()
-        response.read.decode.return_value = "'['foo', {'bar':['baz', null, 1.0, 2]}]'"
-        fetch_url.return_value = (response, {'status': test_input})
-        wrapper.request('{}/apis'.format(API_PATH), 'GET')
-        module.fail_json.assert_not_called()
-
-    def test_create_plan(self, mocker, module):
-        api_id = "1234"
-        wrapper = gravitee_gateway.PlanWrapper(module, api_id, dict(CREATE_API))
-        wrapper.request = mocker.MagicMock()
+    def test_request_responses(self, fetch_url_mock, module, return_responses, expected_response):
+        module.params['return_responses'] = return_responses
+        module.result = {'responses': []}
+        wrapper = ApiGatewayWrapper(module)
+        fetch_url_mock.return_value = (None, {'status': 200})
+        wrapper.request(APIS, 'POST', CREATE_API)
+        assert module.result['responses'] == [expected_response]
+
+    def test_auth_strategy_configured_once(self, module):
+        module.params['token'] = 'jwt'
+        wrapper = ApiGatewayWrapper(module)
+        assert wrapper.headers == {"Content-Type": 'application/json', "Authorization": 'Bearer jwt'}
+        assert 'force_basic_auth' not in module.params
+
+    def test_create_plan(self, plan_wrapper):
+        wrapper = plan_wrapper(dict(CREATE_API))
+        wrapper.request.return_value = {'response_body': {"id": "456"}}
         wrapper.create_or_update()
-        wrapper.request.assert_any_call('{}/apis/{}/plans'.format(API_PATH, api_id), 'POST', CREATE_API)
+        wrapper.request.assert_any_call(PLANS_1234, 'POST', CREATE_API)
         assert wrapper.request.call_count == 1
 
-    def test_update_plan(self, mocker, module):
-        api_id = "1234"
-        wrapper = gravitee_gateway.PlanWrapper(module, api_id, {"id": "456"})
-        wrapper.request = mocker.MagicMock()
+    def test_update_plan(self, plan_wrapper):
+        wrapper = plan_wrapper({"id": "456"})
         wrapper.create_or_update()
-        wrapper.request.assert_any_call('{}/apis/{}/plans/{}'.format(API_PATH, api_id, "456"), 'PUT', {"id": "456"})
+        wrapper.request.assert_any_call(PLANS_1234 + '/456', 'PUT', {"id": "456"})
         assert wrapper.request.call_count == 1
 
-    def test_remove_plan(self, mocker, module):
-        api_id = "1234"
-        wrapper = gravitee_gateway.PlanWrapper(module, api_id, {"id":"456"})
-        wrapper.request = mocker.MagicMock()
+    def test_remove_plan(self, plan_wrapper):
+        wrapper = plan_wrapper({"id": "456"})
         wrapper.remove()
-        wrapper.request.assert_any_call('{}/apis/{}/plans/{}'.format(API_PATH, api_id, "456"), 'DELETE')
+        wrapper.request.assert_any_call(PLANS_1234 + '/456', 'DELETE')
         assert wrapper.request.call_count == 1
 
-    def test_create_api_without_config(self, mocker, module):
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
+    def test_dispatch_fails_once_all_wrappers_are_done(self, api_wrapper, plan_wrapper, module):
+        module.fail_json.side_effect = SystemExit(1)
+        wrappers = [plan_wrapper({"id": plan_id}) for plan_id in ("456", "786")]
+        wrappers[0].request.side_effect = RequestFailure('error')
+        wrapper = api_wrapper()
+        with pytest.raises(SystemExit):
+            wrapper.dispatch(wrappers, 'remove')
+        wrappers[1].request.assert_called_once_with(PLANS_1234 + '/786', 'DELETE')
+        module.fail_json.assert_called_once_with(msg='error')
+
+    def test_dispatch_reports_worker_exit(self, api_wrapper, plan_wrapper, module):
+        module.fail_json.side_effect = SystemExit(1)
+        wrappers = [plan_wrapper({"id": plan_id}) for plan_id in ("456", "786")]
+        for plan in wrappers:
+            plan.request.side_effect = SystemExit(1)
+        wrapper = api_wrapper()
+        with pytest.raises(SystemExit):
+            wrapper.dispatch(wrappers, 'remove')
+        module.fail_json.assert_called_once_with(msg='request aborted with exit status 1\nrequest aborted with exit status 1')
+
+    def test_create_api_without_config(self, api_wrapper):
+        wrapper = api_wrapper()
         with pytest.raises(AssertionError):
             wrapper.create()
         wrapper.request.assert_not_called()
 
-    def test_create_api_with_unavailable_context_path(self, mocker, module):
-        module.params['present'] = 'present'
-        module.params['config'] = CREATE_API
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
+    def test_create_api_with_unavailable_context_path(self, api_wrapper):
+        wrapper = api_wrapper(present='present', config=CREATE_API)
         wrapper.request.side_effect = SystemExit(1)
         with pytest.raises(SystemExit):
             wrapper.create()
-        wrapper.request.assert_any_call('{}/apis/verify'.format(API_PATH), 'POST', {'context_path': CREATE_API['contextPath']})
+        wrapper.request.assert_any_call(APIS + '/verify', 'POST', {'context_path': CREATE_API['contextPath']})
         assert wrapper.request.call_count == 1
 
-    def test_create_simple_private_api(self, mocker, module):
-        module.params['present'] = 'present'
-        module.params['config'] = CREATE_API
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
+    def test_create_simple_private_api(self, api_wrapper):
+        wrapper = api_wrapper(present='present', config=CREATE_API, transfer_ownership={'user': None})
+        wrapper.request.return_value = {'response_body': dict(CREATE_RESPONSE)}
         wrapper.create()
-        wrapper.request.assert_any_call('{}/apis/verify'.format(API_PATH), 'POST', {'context_path': CREATE_API['contextPath']})
-        wrapper.request.assert_any_call('{}/apis'.format(API_PATH), 'POST', CREATE_API)
+        wrapper.request.assert_any_call(APIS + '/verify', 'POST', {'context_path': CREATE_API['contextPath']})
+        wrapper.request.assert_any_call(APIS, 'POST', CREATE_API)
         assert wrapper.request.call_count == 2
 
-    @mock.patch('library.gravitee_gateway.PlanWrapper', autospec=True)
-    def test_create_public_started_api_with_plans_and_transfer_owner(self, plan_mock, mocker, module):
-        module.params['state'] = 'started'
-        module.params['config'] = CREATE_API
-        module.params['visibility'] = 'PUBLIC'
-        module.params['transfer_ownership'] = TRANSFER_OWNER
-        module.params['plans'] = [{}, {}]
-        api_id = '1234'
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
-        wrapper.transfer_owner = mocker.MagicMock()
-        wrapper.request.side_effect = [None, {'response_body': CREATE_RESPONSE}, None, None, None, None, {'response_body': {'state': 'initialized'}}, None]
+    @patch('library.gravitee_gateway.PlanWrapper')
+    def test_create_public_started_api_with_plans_and_transfer_owner(self, plan_mock, mocker, api_wrapper):
+        wrapper = api_wrapper(state='started', config=CREATE_API, visibility='PUBLIC',
+                              transfer_ownership=TRANSFER_OWNER, plans=[{}, {}])
+        wrapper.transfer_owner = mocker.Mock()
+        wrapper.request.side_effect = iter(CREATE_STARTED_SIDE_EFFECTS)
         wrapper.create()
-        wrapper.request.assert_any_call('{}/apis/verify'.format(API_PATH), 'POST', {'context_path': '/test/api'})
-        wrapper.request.assert_any_call('{}/apis'.format(API_PATH), 'POST', CREATE_API)
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id), 'PUT', mocker.ANY)
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id) + '/deploy', 'POST')
-        wrapper.request.assert_any_call('{}/apis/{}?action=START'.format(API_PATH, api_id), 'POST')
-        plan_mock.create_or_update.call_count == 2
-        wrapper.transfer_owner.search.call_count == 1
-
-    @mock.patch('library.gravitee_gateway.PlanWrapper', autospec=True)
-    def test_update_public_api_with_plans_and_transfer_owner(self, plan_mock, mocker, module):
-        api_id = '1234'
-        module.params['state'] = 'present'
-        module.params['config'] = CREATE_API
-        module.params['visibility'] = 'PUBLIC'
-        module.params['api_id'] = api_id
-        module.params['transfer_ownership'] = TRANSFER_OWNER
-        module.params['plans'] = [{"id": "1234"}, {}]
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
-        wrapper.transfer_owner = mocker.MagicMock()
+        wrapper.request.assert_has_calls([
+            call(APIS + '/verify', 'POST', {'context_path': '/test/api'}),
+            call(APIS, 'POST', CREATE_API),
+            call(API_1234, 'PUT', mocker.ANY),
+            call(API_1234 + '/deploy', 'POST'),
+            call(API_1234 + '?action=START', 'POST')
+        ], any_order=True)
+        assert wrapper.request.call_count == 5
+        assert plan_mock.return_value.create_or_update.call_count == 2
+        wrapper.transfer_owner.assert_called_once_with()
+
+    @patch('library.gravitee_gateway.PlanWrapper')
+    def test_update_public_api_with_plans_and_transfer_owner(self, plan_mock, mocker, api_wrapper):
+        wrapper = api_wrapper(state='present', config=CREATE_API, visibility='PUBLIC', api_id=API_ID,
+                              transfer_ownership=TRANSFER_OWNER, plans=[{"id": "1234"}, {}])
+        wrapper.request.return_value = {'response_body': {}}
+        wrapper.transfer_owner = mocker.Mock()
         wrapper.update()
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id), 'PUT', CREATE_API)
-        wrapper.request.assert_any_call('{}/apis/{}/deploy'.format(API_PATH, api_id), 'POST')
-        plan_mock.create_or_update.call_count == 2
-        wrapper.transfer_owner.search.call_count == 1
-
-    def test_update_without_id(self, mocker, module):
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
+        wrapper.request.assert_any_call(API_1234, 'PUT', CREATE_API)
+        assert wrapper.request.call_args_list.count(call(API_1234 + '/deploy', 'POST')) == 1
+        assert plan_mock.return_value.create_or_update.call_count == 2
+        wrapper.transfer_owner.assert_called_once_with()
+
+    def test_update_api_without_changes(self, api_wrapper):
+        wrapper = api_wrapper(state='present', config=CREATE_API, api_id=API_ID, transfer_ownership={'user': None})
+        wrapper.request.return_value = {'response_body': dict(CREATE_RESPONSE, **CREATE_API)}
+        wrapper.update()
+        wrapper.request.assert_called_once_with(API_1234, 'GET')
+
+    def test_update_without_id(self, api_wrapper):
+        wrapper = api_wrapper()
         with pytest.raises(AssertionError):
             wrapper.update()
         assert wrapper.request.call_count == 0
 
-    @pytest.mark.parametrize("test_input,expected_count_call", [
-        ({'current_state': 'started', 'target_state': 'stopped', 'action': 'STOP'}, 2),
-        ({'current_state': 'stopped', 'target_state': 'started', 'action': 'START'}, 2),
-        pytest.param({'current_state': 'started', 'target_state': 'started', 'action': 'START'}, 1, marks=pytest.mark.xfail),
-        pytest.param({'current_state': 'stopped', 'target_state': 'stopped', 'action': 'STOP'}, 1, marks=pytest.mark.xfail)
-    ])
-    def test_start_stop_api(self, mocker, module, test_input, expected_count_call):
-        api_id = '1234'
-        module.params['api_id'] = api_id
-        module.params['state'] = test_input['target_state']
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
-        wrapper.request.side_effect = [{'response_body': {'state': test_input['current_state']}}, None]
+    @pytest.mark.parametrize("current,target", list(itertools.product(["started", "stopped"], repeat=2)))
+    def test_start_stop_api(self, api_wrapper, current, target):
+        if current == target:
+            pytest.skip("no lifecycle action expected")
+        action = "STOP" if target == "stopped" else "START"
+        wrapper = api_wrapper(api_id=API_ID, state=target, transfer_ownership={'user': None})
+        wrapper.request.side_effect = [{'response_body': {'state': current}}, None]
         wrapper.update()
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id), 'GET')
-        wrapper.request.assert_any_call('{}/apis/{}?action={}'.format(API_PATH, api_id, test_input['action']), 'POST')
-        assert wrapper.request.call_count == expected_count_call
-
-    @mock.patch('library.gravitee_gateway.PlanWrapper.request')
-    def test_remove_api(self, request_mock, mocker, module):
-        api_id = '1234'
-        module.params['api_id'] = api_id
-        module.params['state'] = 'absent'
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        wrapper.request = mocker.MagicMock()
-        wrapper.request.side_effect = [{'response_body': [{'id': '456'}, {'id': '786'}]}, {'response_body': {'state': 'started'}}, None, None]
-        wrapper.remove()
-        request_mock.assert_any_call('{}/apis/{}/plans/456'.format(API_PATH, api_id), 'DELETE')
-        request_mock.assert_any_call('{}/apis/{}/plans/786'.format(API_PATH, api_id), 'DELETE')
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id), 'GET')
-        wrapper.request.assert_any_call('{}/apis/{}?action=STOP'.format(API_PATH, api_id), 'POST')
-        wrapper.request.assert_any_call('{}/apis/{}'.format(API_PATH, api_id), 'DELETE')
-
-    @mock.patch('library.gravitee_gateway.ApiWrapper.request')
-    def test_transfer_ownership_without_api_id(self, request_mock, module):
-        wrapper = gravitee_gateway.ApiWrapper(module)
-        with pytest.raises(AssertionError):
-            wrapper.transfer_owner()
-        request_mock.request.assert_not_called()
+        wrapper.request.assert_any_call(API_1234, 'GET')
+        wrapper.request.assert_any_call(API_1234 + '?action=' + action, 'POST')
+        assert wrapper.request.call_count == 2
 
-    @mock.patch('library.gravitee_gateway.ApiWrapper.request')
-    def test_transfer_ownership_without_ownershipdata(self, request_mock, module):
-        module.params['api_id'] = '1234'
-        wrapper = gravitee_gateway.ApiWrapper(module)
+    def test_remove_api(self, plan_request_mock, api_wrapper):
+        wrapper = api_wrapper(api_id=API_ID, state='absent')
+        wrapper.request.side_effect = iter(REMOVE_SIDE_EFFECTS)
+        wrapper.remove()
+        plan_request_mock.assert_has_calls([
+            call(PLANS_1234 + '/456', 'DELETE'),
+            call(PLANS_1234 + '/786', 'DELETE')
+        ], any_order=True)
+        wrapper.request.assert_has_calls([
+            call(API_1234, 'GET'),
+            call(API_1234 + '?action=STOP', 'POST'),
+            call(API_1234, 'DELETE')
+        ], any_order=True)
+
+    @pytest.mark.parametrize("missing", ["api_id", "transfer_ownership"])
+    def test_transfer_ownership_without_required_param(self, api_wrapper, missing):
+        params = {"api_id": API_ID, "transfer_ownership": TRANSFER_OWNER}
+        del params[missing]
+        wrapper = api_wrapper(**params)
         with pytest.raises(AssertionError):
             wrapper.transfer_owner()
-        request_mock.request.assert_not_called()
+        wrapper.request.assert_not_called()
 
-    @mock.patch('library.gravitee_gateway.UserWrapper.search')
-    def test_transfer_ownership_failed_if_many_users(self, user_search_mock, mocker, module):
-        api_id = '1234'
-        module.params['api_id'] = api_id
-        module.params['transfer_ownership'] = TRANSFER_OWNER
+    def test_transfer_ownership_failed_if_many_users(self, user_search_mock, user_payload, api_wrapper, module):
         module.fail_json.side_effect = SystemExit(1)
-        api_wrapper = gravitee_gateway.ApiWrapper(module)
-        api_wrapper.request = mocker.MagicMock()
-        user_search_mock.return_value = [
-            {
-                "reference": 'ZXlKamRIa2lPaUpLVjFRaUxDSmxibU',
-                "firstname": 'admin',
-                "lastname": 'admin',
-                "id": '09c92aaa-998d-5db5-e79b-add2a7e5ad4',
-                "displayName": 'admin'
-            },
-            {
-                "reference": 'ZXlKamRIa2lPaUpLVjFRaUxDSmxibU',
-                "firstname": 'admin',
-                "lastname": 'admin',
-                "displayName": 'admin'
-            }
-        ]
+        wrapper = api_wrapper(api_id=API_ID, transfer_ownership=TRANSFER_OWNER)
+        user_search_mock.return_value = user_payload["many"]
         with pytest.raises(SystemExit):
-            api_wrapper.transfer_owner()
-        api_wrapper.request.assert_not_called()
-
-    @mock.patch('library.gravitee_gateway.UserWrapper.search')
-    def test_transfer_ownership(self, user_wrapper_mock, mocker, module):
-        api_id = '1234'
-        module.params['api_id'] = api_id
-        module.params['transfer_ownership'] = TRANSFER_OWNER
-        user = {
-            "reference": 'ZXlKamRIa2lPaUpLVjFRaUxDSmxibU',
-            "firstname": 'admin',
-            "lastname": 'admin',
-            "displayName": 'admin'
-        }
-        user_wrapper_mock.return_value = [user]
-        api_wrapper = gravitee_gateway.ApiWrapper(module)
-        api_wrapper.request = mocker.MagicMock()
-        api_wrapper.transfer_owner()
-        api_wrapper.request.assert_any_call('{}/apis/{}/members/transfer_ownership'.format(API_PATH, api_id), 'POST',
-                                            {'role': TRANSFER_OWNER['owner_role'], 'reference': user['reference']})
-
-    def test_search_user(self, mocker, module):
+            wrapper.transfer_owner()
+        wrapper.request.assert_not_called()
+
+    def test_transfer_ownership(self, user_search_mock, user_payload, api_wrapper):
+        wrapper = api_wrapper(api_id=API_ID, transfer_ownership=TRANSFER_OWNER)
+        user = user_payload["one"][0]
+        user_search_mock.return_value = user_payload["one"]
+        wrapper.transfer_owner()
+        wrapper.request.assert_any_call(API_1234 + '/members/transfer_ownership', 'POST',
+                                        {'role': TRANSFER_OWNER['owner_role'], 'reference': user['reference']})
+
+    def test_search_user(self, user_wrapper, user_payload):
         user_filter = 'ad'
-        expect = {'response_body': [
-            {
-                "reference": 'ZXlKamRIa2lPaUpLVjFRaUxDSmxibU',
-                "firstname": 'admin',
-                "lastname": 'admin',
-                "displayName": 'admin'
-            }]}
-        wrapper = gravitee_gateway.UserWrapper(module)
-        wrapper.request = mocker.MagicMock()
-        wrapper.request.return_value = expect
-        result = wrapper.search(user_filter)
-        wrapper.request.assert_any_call('{}/search/users/?q={}'.format(API_PATH, user_filter), 'GET')
+        expect = {'response_body': user_payload["one"]}
+        user_wrapper.request.return_value = expect
+        result = user_wrapper.search(user_filter)
+        user_wrapper.request.assert_any_call(API_PATH + '/search/users/?q=' + user_filter, 'GET')
         assert result == expect['response_body']
 
-    @mock.patch('library.gravitee_gateway.ConfigurationWrapper.request')
-    def test_search_groups_with_groupname_filtering(self, request_mock, module):
-        name_filter = ['mygroup', 'ext']
-        groups = {'response_body':[{
-            "id": "87b2858d-5466-4a4a-b285-8d54667a4a8a",
-            "name": "mygroup",
-            "created_at": 1521457603916,
-            "updated_at": 1521457603916
-        },
-        {
-            "id": "c2de10db-dbad-49bc-9e10-dbdbad79bcd1",
-            "name": "others",
-            "created_at": 1521458754100,
-            "updated_at": 1521458754100
-        },
-        {
-            "id": "c2de10db-ds-49bc-9e10-dbdbad79bcd0",
-            "name": "external",
-            "created_at": 1521458754100,
-            "updated_at": 1521458754100
-        }]}
-        expected_groups = [{
-            "id": "87b2858d-5466-4a4a-b285-8d54667a4a8a",
-            "name": "mygroup",
-            "created_at": 1521457603916,
-            "updated_at": 1521457603916
-        },
-        {
-            "id": "c2de10db-ds-49bc-9e10-dbdbad79bcd0",
-            "name": "external",
-            "created_at": 1521458754100,
-            "updated_at": 1521458754100
-        }]
-        request_mock.return_value = groups
-        conf_wrapper = gravitee_gateway.ConfigurationWrapper(module)
-        filtered_groups = conf_wrapper.search_groups(name_filter)
-        request_mock.assert_any_call('{}/configuration/groups'.format(API_PATH), 'GET')
-        assert filtered_groups == expected_groups
-
-    @mock.patch('library.gravitee_gateway.ConfigurationWrapper.request')
-    def test_search_groups_with_no_filtering(self, request_mock, module):
-        groups = {'response_body':[{
-            "id": "87b2858d-5466-4a4a-b285-8d54667a4a8a",
-            "name": "mygroup",
-            "created_at": 1521457603916,
-            "updated_at": 1521457603916
-        },
-        {
-            "id": "c2de10db-dbad-49bc-9e10-dbdbad79bcd0",
-            "name": "mygroup2",
-            "created_at": 1521458754100,
-            "updated_at": 1521458754100
-        },
-        {
-            "id": "c2de10db-ds-49bc-9e10-dbdbad79bcd0",
-            "name": "external",
-            "created_at": 1521458754100,
-            "updated_at": 1521458754100
-        }]}
-        request_mock.return_value = groups
-        conf_wrapper = gravitee_gateway.ConfigurationWrapper(module)
-        filtered_groups = conf_wrapper.search_groups()
-        request_mock.assert_any_call('{}/configuration/groups'.format(API_PATH), 'GET')
-        assert filtered_groups == groups['response_body']
-
-    @mock.patch('library.gravitee_gateway.ConfigurationWrapper.search_groups')
-    def test_create_page(self, search_groups, module):
-        api_id = '1234'
-        search_groups.return_value = [{
-            "id": "87b2858d-5466-4a4a-b285-8d54667a4a8a",
-            "name": "mygroup"
-        }]
+    @pytest.mark.parametrize("name_filter,expected_ids", [
+        (None, [group['id'] for group in CONFIGURATION_GROUPS]),
+        (['mygroup', 'ext'], [MYGROUP_ID, EXTERNAL_ID])
+    ])
+    def test_search_groups(self, config_wrapper, name_filter, expected_ids):
+        if name_filter is None:
+            filtered_groups = config_wrapper.search_groups()
+        else:
+            filtered_groups = config_wrapper.search_groups(name_filter)
+        config_wrapper.request.assert_any_call(GROUPS, 'GET')
+        assert [group['id'] for group in filtered_groups] == expected_ids
+
+    def test_search_groups_fetched_once(self, config_wrapper):
+        config_wrapper.search_groups(['mygroup'])
+        config_wrapper.search_groups()
+        config_wrapper.request.assert_called_once_with(GROUPS, 'GET')
+
+    def test_get_groups_by_name(self, config_wrapper):
+        assert config_wrapper.get_groups_by_name() == {group['name']: group['id'] for group in CONFIGURATION_GROUPS}
+
+    def test_create_page(self, page_wrapper):
         expected_page = {
             "order": 1,
             "type": "SWAGGER",
-            "excluded_groups": ["87b2858d-5466-4a4a-b285-8d54667a4a8a"]
+            "excluded_groups": [MYGROUP_ID]
         }
-        PAGE["order"] = 1
-        page_wrapper = gravitee_gateway.PageWrapper(module, api_id, PAGE)
-        page_wrapper.request = mock.MagicMock()
-        page_wrapper.request.return_value = {'response_body': {"id": "a986531f-7930-4a1e-8653-1f79305a1e69"}}
-        page_wrapper.create_or_update()
-        page_wrapper.request.assert_called_once_with('{}/apis/{}/pages'.format(API_PATH, api_id), 'POST', expected_page)
-
-    @mock.patch('library.gravitee_gateway.ConfigurationWrapper.search_groups')
-    def test_update_page(self, search_groups, module):
-        api_id = '1234'
-        search_groups.return_value = [{
-            "id": "87b2858d-5466-4a4a-b285-8d54667a4a8a",
-            "name": "mygroup"
-        }]
+        wrapper = page_wrapper(dict(PAGE, order=1))
+        wrapper.request.return_value = {'response_body': {"id": "a986531f-7930-4a1e-8653-1f79305a1e69"}}
+        wrapper.create_or_update()
+        wrapper.request.assert_called_once_with(PAGES_1234, 'POST', expected_page)
+
+    def test_update_page(self, page_wrapper):
         expected_page = {
             "order": 1,
-            "excluded_groups": ["87b2858d-5466-4a4a-b285-8d54667a4a8a"]
+            "excluded_groups": [MYGROUP_ID]
         }
-        PAGE["order"] = 1
-        PAGE["id"] = "87b2858d-5466-4a4a-b285-8d54667a4a8a"
-        page_wrapper = gravitee_gateway.PageWrapper(module, api_id, PAGE)
-        page_wrapper.request = mock.MagicMock()
-        page_wrapper.request.return_value = {'response_body': {"id": "a986531f-7930-4a1e-8653-1f79305a1e69"}}
-        page_wrapper.create_or_update()
-        page_wrapper.request.assert_called_once_with('{}/apis/{}/pages/{}'.format(API_PATH, api_id, PAGE['id']), 'PUT', expected_page)
+        page = dict(PAGE, order=1, id="87b2858d-5466-4a4a-b285-8d54667a4a8a")
+        wrapper = page_wrapper(page)
+        wrapper.request.return_value = {'response_body': {"id": "a986531f-7930-4a1e-8653-1f79305a1e69"}}
+        wrapper.create_or_update()
+        wrapper.request.assert_called_once_with(PAGES_1234 + '/' + page['id'], 'PUT', expected_page)